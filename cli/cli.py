@@ -4,35 +4,117 @@
     -i INPUT_FILE    (每行一个 IP)
     -o OUTPUT_CSV    (输出 CSV 文件路径)
     -u UA_FILE       (每行一个 User-Agent，可选)
-    -t THREADS       (并发线程数, default 10)
+    -t THREADS       (并发请求数, default 10)
+    --cache DIR      (结果缓存目录，可选；重复运行时跳过已成功查询的 IP)
+    --rps N          (每秒最多发出的请求数，可选；默认不限速)
+    --seed N         (随机种子，可选；固定 UA 选择顺序，便于复现)
+    --parse-workers N (页面解析进程数, default 1 即在主进程内解析)
 示例:
     python -m go_scamalytics_py.cli.cli -i ips.txt -o out.csv -u ualist.txt -t 20
 """
 
 import argparse
+import asyncio
 import csv
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List
+import json
+import sys
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
-from tqdm import tqdm
+import httpx
+from tqdm.auto import tqdm
 
-from ipchecker import CheckIP
+from ipchecker import CheckIP, RateLimiter, seed
+
+_CACHE_FILE = "scamalytics_cache.json"
+
+# 写 CSV: 包含固定列 ip, score, risk, error; 其余字段放入 raw_json 列（转成字符串）
+OUT_FIELDS = ("ip", "score", "risk", "error", "raw_json")
 
 def read_lines_strip(path: str) -> List[str]:
+    # 一次读入后用 C 实现的 splitlines/str.strip 处理，避免逐行迭代文件对象
     with open(path, "r", encoding="utf-8") as f:
-        return [line.strip() for line in f if line.strip()]
+        lines = f.read().splitlines()
+    return [line for line in map(str.strip, lines) if line]
+
+def load_cache(cache_dir: str) -> Dict[str, Dict[str, Any]]:
+    path = os.path.join(cache_dir, _CACHE_FILE)
+    if not os.path.isfile(path):
+        return {}
+    # 缓存是纯 JSON：读一个被改坏/不完整的文件只会丢缓存，不会执行任何代码
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache {path}: {e}", file=sys.stderr)
+        return {}
+    if not isinstance(cache, dict):
+        print(f"Ignoring malformed cache {path}", file=sys.stderr)
+        return {}
+    return {ip: r for ip, r in cache.items() if isinstance(r, dict)}
+
+def save_cache(cache_dir: str, cache: Dict[str, Dict[str, Any]]) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, _CACHE_FILE)
+    # 先写临时文件再替换，避免中断时留下半截缓存
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+async def process_ip(ip: str, user_agents: List[str], client: httpx.AsyncClient,
+                     sem: asyncio.Semaphore, limiter: Optional[RateLimiter],
+                     parse_executor: Optional[Executor]) -> Tuple[str, Dict[str, Any]]:
+    async with sem:
+        try:
+            return ip, await CheckIP(ip, user_agents, client=client, limiter=limiter,
+                                     parse_executor=parse_executor)
+        except Exception as e:
+            return ip, {"ip": ip, "error": f"exception: {str(e)}"}
+
+async def run_checks(ips: List[str], user_agents: List[str], concurrency: int,
+                     on_result: Callable[[str, Dict[str, Any]], None], rps: Optional[float] = None,
+                     parse_executor: Optional[Executor] = None) -> None:
+    """按完成顺序把 (输入 IP, 结果) 交给 on_result。"""
+    sem = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rps) if rps else None
+    limits = httpx.Limits(max_keepalive_connections=concurrency, max_connections=concurrency * 2)
+    # 整个批次共用一个 client：同一 host 的连接池 + keep-alive
+    # requests 默认跟随重定向，httpx 不会；保持原行为
+    async with httpx.AsyncClient(http2=True, limits=limits, follow_redirects=True) as client:
+        tasks = [process_ip(ip, user_agents, client, sem, limiter, parse_executor) for ip in ips]
+        # 限制重绘频率：结果密集到达时（如大多命中）进度条本身会成为串行点
+        progress = tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Checking IPs",
+                        mininterval=0.5, smoothing=0.1)
+        for fut in progress:
+            on_result(*await fut)
 
-def process_ip(ip: str, user_agents: List[str]):
-    return CheckIP(ip, user_agents)
+def result_to_row(r: Dict[str, Any]) -> Tuple[Any, ...]:
+    """按 OUT_FIELDS 的列顺序返回一行（tuple，交给 csv.writer）。"""
+    # 如果解析失败，但 raw 字段在返回中（例如解析失败返回 partial raw string）
+    raw_json = r.get("raw_json") or r.get("raw", "")
+    return (r.get("ip"), r.get("score", ""), r.get("risk", ""), r.get("error", ""), raw_json)
 
 def Start(argv: List[str] = None):
     p = argparse.ArgumentParser(description="go-scamalytics Python CLI (scrape scamalytics.com)")
     p.add_argument("-i", "--input", required=True, help="Input file with one IP per line")
     p.add_argument("-o", "--output", required=True, help="Output CSV file")
     p.add_argument("-u", "--useragents", required=False, help="File with one User-Agent per line (optional)")
-    p.add_argument("-t", "--threads", type=int, default=10, help="Number of concurrent threads (default 10)")
+    p.add_argument("-t", "--threads", type=int, default=10, help="Number of concurrent requests (default 10)")
+    p.add_argument("--cache", required=False, metavar="DIR", help="Directory to cache successful lookups across runs (optional)")
+    p.add_argument("--rps", type=float, required=False, metavar="N", help="Max requests per second to scamalytics.com (optional, default unlimited)")
+    p.add_argument("--seed", type=int, required=False, metavar="N", help="Random seed for User-Agent selection (optional)")
+    p.add_argument("--parse-workers", type=int, default=1, metavar="N",
+                   help="Processes used to parse pages; >1 only pays off for very large pages (default 1, parse in-process)")
     args = p.parse_args(argv)
+    if args.rps is not None and args.rps <= 0:
+        p.error("--rps must be positive")
+    if args.parse_workers < 1:
+        p.error("--parse-workers must be at least 1")
+    if args.seed is not None:
+        seed(args.seed)
 
     if not os.path.isfile(args.input):
         raise SystemExit(f"Input file not found: {args.input}")
@@ -42,42 +124,45 @@ def Start(argv: List[str] = None):
     if args.useragents and os.path.isfile(args.useragents):
         user_agents = read_lines_strip(args.useragents)
 
-    results = []
-    # 并发查找
-    with ThreadPoolExecutor(max_workers=args.threads) as ex:
-        futures = {ex.submit(process_ip, ip, user_agents): ip for ip in ips}
-        for fut in tqdm(as_completed(futures), total=len(futures), desc="Checking IPs"):
-            ip = futures[fut]
-            try:
-                res = fut.result()
-            except Exception as e:
-                res = {"ip": ip, "error": f"exception: {str(e)}"}
-            results.append(res)
+    # 重复 IP 只查一次（保持首次出现的顺序），写 CSV 时按出现次数重复输出
+    ip_counts = Counter(ips)
+    cache = load_cache(args.cache) if args.cache else {}
+    pending = [ip for ip in ip_counts if ip not in cache]
 
-    # 写 CSV: 包含固定列 ip, score, risk, error; 其余字段放入 raw_json 列（转成字符串）
-    out_fields = ["ip", "score", "risk", "error", "raw_json"]
+    # 先打开文件，结果一到就写一行，不在内存里攒全部结果
     out_path = args.output
     os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
-    with open(out_path, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=out_fields)
-        writer.writeheader()
-        for r in results:
-            row = {
-                "ip": r.get("ip"),
-                "score": r.get("score", ""),
-                "risk": r.get("risk", ""),
-                "error": r.get("error", ""),
-                "raw_json": ""
-            }
-            if "_raw_parsed" in r:
-                try:
-                    import json
-                    row["raw_json"] = json.dumps(r["_raw_parsed"], ensure_ascii=False)
-                except Exception:
-                    row["raw_json"] = str(r["_raw_parsed"])
-            # 如果解析失败，但 raw 字段在返回中（例如解析失败返回 partial raw string）
-            if "raw" in r and not row["raw_json"]:
-                row["raw_json"] = r["raw"]
-            writer.writerow(row)
-
-    print(f"Wrote {len(results)} records to {out_path}")
+    written = 0
+    # 缓存放在 finally 里保存：Ctrl-C / 崩溃时已经成功的查询也不会丢
+    try:
+        with open(out_path, "w", newline="", encoding="utf-8") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(OUT_FIELDS)
+
+            def write_result(ip: str, r: Dict[str, Any]) -> None:
+                nonlocal written
+                count = ip_counts[ip]
+                writer.writerows((result_to_row(r),) * count)
+                written += count
+                # 只缓存成功的结果，失败的下次重新查
+                if args.cache and "error" not in r:
+                    cache[ip] = r
+
+            for ip in ip_counts:
+                if ip in cache:
+                    write_result(ip, cache[ip])
+
+            # 并发查找：单个事件循环 + 信号量限制同时在途的请求数
+            # --parse-workers > 1 时解析阶段放进进程池，绕开 GIL；小页面下 IPC 开销反而更大
+            parse_executor = ProcessPoolExecutor(max_workers=args.parse_workers) if args.parse_workers > 1 else None
+            try:
+                asyncio.run(run_checks(pending, user_agents, args.threads, write_result, rps=args.rps,
+                                       parse_executor=parse_executor))
+            finally:
+                if parse_executor is not None:
+                    parse_executor.shutdown()
+    finally:
+        if args.cache:
+            save_cache(args.cache, cache)
+
+    print(f"Wrote {written} records to {out_path}")
@@ -1,3 +1,3 @@
-from .ipchecker import CheckIP
+from .ipchecker import CheckIP, RateLimiter, seed
 
-__all__ = ["CheckIP"]
+__all__ = ["CheckIP", "RateLimiter", "seed"]
@@ -1,7 +1,7 @@
 """
 ipchecker.ipchecker
 
-提供 CheckIP(ip, user_agents_list) -> dict 功能。
+提供 async CheckIP(ip, user_agents_list, client=...) -> dict 功能。
 目标：向 https://scamalytics.com/ip/{ip} 请求页面（随机或指定 User-Agent），
 解析页面中显示的 "IP Fraud Risk API" JSON 块并返回一个字典，至少包含:
     {"ip": "...", "score": "...", "risk": "...", ...}
@@ -9,12 +9,28 @@ ipchecker.ipchecker
 """
 
 from __future__ import annotations
-import requests
+import asyncio
+import httpx
 import random
 import re
 import json
+from concurrent.futures import Executor
 from typing import List, Dict, Any, Optional
 
+try:
+    # orjson 是可选依赖（pip install .[fast]），没有时退回标准库 json
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # lxml 同样可选：慢路径里用它（C 实现的 HTML 解析器）去标签，比正则更可靠
+    from lxml import etree as _lxml_etree
+    from lxml import html as _lxml_html
+except ImportError:
+    _lxml_etree = None
+    _lxml_html = None
+
 _DEFAULT_USER_AGENTS = [
     # 提供若干常见 UA 供随机选择；CLI 也允许用户传入自定义列表。
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.3",
@@ -24,121 +40,278 @@ _DEFAULT_USER_AGENTS = [
 
 _REQUEST_TIMEOUT = 15  # seconds
 
+# 被限流 / 服务端临时错误时的重试：指数退避 + 随机抖动
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_MAX_ATTEMPTS = 4
+
+_API_MARKER = "IP Fraud Risk API"
+_API_MARKER_BYTES = _API_MARKER.encode("ascii")
+_STREAM_CHUNK_SIZE = 16384
+# 页面按字节扫描，只在取出 JSON 块 / 字段值时才解码
+_PAGE_ENCODING = "utf-8"
+_WHITESPACE = frozenset(b" \t\n\r\f\v")
+_COLON = ord(":")
+_QUOTE = ord('"')
+# 降级查找只在 marker 之后的窗口里搜索，而不是整页（页面常常 100KB+）
+_FALLBACK_WINDOW = 8192
+# 找不到 marker 时只看页面开头这么多字节
+_FALLBACK_HEAD = 16384
+
+# 预编译正则：每个 IP 都会用到，避免每次调用都走 re 的缓存查找/编译
+_RE_BRACE = re.compile(rb"[{}]")
+# 感知字符串的 JSON 扫描：完整的字符串字面量整体匹配（其中的括号不计数），
+# 落单的 '"' 表示字符串还没结束（页面被截断或不是合法 JSON）
+_RE_JSON_SCAN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}"]', re.DOTALL)
+_RE_TAG = re.compile(r"<[^>]+>")
+_RE_COMMENT = re.compile(r"//.*?$", re.MULTILINE)
+_RE_TRAIL_OBJ = re.compile(r",\s*}")
+_RE_TRAIL_ARR = re.compile(r",\s*]")
+
+# 模块私有的随机数生成器：UA 选择和重试抖动都用它，可通过 seed() 复现
+_rng = random.Random()
+_choice = _rng.choice
+
+def seed(value: Optional[int]) -> None:
+    """为 UA 选择 / 重试抖动设置随机种子（None 表示重新随机初始化）。"""
+    _rng.seed(value)
+
 def _choose_user_agent(user_agents: Optional[List[str]]) -> str:
-    if user_agents:
-        return random.choice(user_agents)
-    return random.choice(_DEFAULT_USER_AGENTS)
+    return _choice(user_agents or _DEFAULT_USER_AGENTS)
 
-def _fetch_page(ip: str, user_agent: str, session: Optional[requests.Session] = None) -> str:
+async def _fetch_page(client: httpx.AsyncClient, ip: str, user_agent: str) -> bytes:
     url = f"https://scamalytics.com/ip/{ip}"
     headers = {
         "User-Agent": user_agent,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
     }
-    s = session or requests.Session()
-    resp = s.get(url, headers=headers, timeout=_REQUEST_TIMEOUT)
-    resp.raise_for_status()
-    return resp.text
+    # 流式读取：边下载边检查，JSON 块一旦完整就停止读取页面剩余部分。
+    # 只在 HTTP/2 下提前停止：HTTP/1.1 提前关闭响应会连带关闭连接，丢掉 keep-alive
+    async with client.stream("GET", url, headers=headers, timeout=_REQUEST_TIMEOUT) as resp:
+        resp.raise_for_status()
+        stop_early = resp.http_version == "HTTP/2"
+        buf = bytearray()
+        marker_pos = -1
+        json_start = -1
+        async for chunk in resp.aiter_bytes(_STREAM_CHUNK_SIZE):
+            buf += chunk
+            if not stop_early:
+                continue
+            if marker_pos == -1:
+                marker_pos = buf.find(_API_MARKER_BYTES)
+            if marker_pos != -1 and json_start == -1:
+                json_start = buf.find(b"{", marker_pos)
+            # 和解析阶段同样的字符串感知配对，字符串值里的 '}' 不会让读取提前结束
+            if json_start != -1 and _find_json_end(buf, json_start) is not None:
+                break
+        # 不整页解码：后续扫描都在 bytes 上做，只解码需要的片段
+        return bytes(buf)
 
-def _extract_json_block_from_text(text: str) -> Optional[str]:
+class RateLimiter:
     """
-    在页面文本中寻找 'IP Fraud Risk API' 后面紧跟的 JSON 对象块。
-    我们尽量用“找到第一个 '{' 并用括号配对提取完整 JSON” 的方式，
-    以便处理多行格式化 JSON。
-    返回 JSON 字符串（如果成功），否则 None。
+    简单的异步限速器：所有请求共享一个实例，保证相邻两次 acquire()
+    之间至少间隔 1/rps 秒，避免并发一上来就被站点 429。
     """
-    # 定位关键词
-    marker_pos = text.find("IP Fraud Risk API")
-    if marker_pos == -1:
-        # 备用：有些页面可能直接包含 `"ip":"...","score":"..."` 但缺关键词
-        marker_pos = 0
-
-    # 从 marker_pos 向后找第一个 '{'
-    start = text.find("{", marker_pos)
-    if start == -1:
-        return None
 
-    # 用括号计数器向后扫描直到匹配闭合
+    def __init__(self, rps: float):
+        if rps <= 0:
+            raise ValueError("rps must be positive")
+        self._interval = 1.0 / rps
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            wait = self._next_at - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now = self._next_at
+            self._next_at = now + self._interval
+
+async def _fetch_page_with_retry(client: httpx.AsyncClient, ip: str, user_agent: str,
+                                 limiter: Optional[RateLimiter]) -> bytes:
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            return await _fetch_page(client, ip, user_agent)
+        except httpx.HTTPStatusError as e:
+            attempt += 1
+            if e.response.status_code not in _RETRY_STATUSES or attempt >= _MAX_ATTEMPTS:
+                raise
+        await asyncio.sleep(2 ** (attempt - 1) + _rng.random())
+
+def _strip_html_tags(fragment: str, use_lxml: bool = True) -> str:
+    """
+    去掉 HTML 标签只留文本；有 lxml 时用 lxml（能处理属性里的 '>'），否则用正则。
+    注意 lxml 的 text_content() 会顺带解码实体（&quot; -> "），可能弄坏 JSON 字符串值，
+    所以调用方在解析失败时会用 use_lxml=False 重试。
+    """
+    if use_lxml and _lxml_html is not None:
+        try:
+            return _lxml_html.fragment_fromstring(fragment, create_parent="div").text_content()
+        except (_lxml_etree.ParserError, ValueError):
+            pass
+    return _RE_TAG.sub("", fragment)
+
+def _decode(data: bytes) -> str:
+    return data.decode(_PAGE_ENCODING, errors="replace")
+
+def _find_block_end(page: bytes, start: int) -> Optional[int]:
+    """从 start 处的 '{' 开始括号配对，返回闭合 '}' 之后的下标（由 finditer 跳过非括号字节）。"""
     depth = 0
-    i = start
-    end = None
-    while i < len(text):
-        ch = text[i]
-        if ch == "{":
+    for m in _RE_BRACE.finditer(page, start):
+        if m.group() == b"{":
             depth += 1
-        elif ch == "}":
+        else:
             depth -= 1
             if depth == 0:
-                end = i + 1
-                break
-        i += 1
-
-    if end is None:
-        return None
+                return m.end()
+    return None
 
-    candidate = text[start:end]
+def _find_json_end(page: bytes, start: int) -> Optional[int]:
+    """
+    和 _find_block_end 一样做括号配对，但跳过 JSON 字符串字面量，
+    所以 `"hostname":"a}b"` 这样的值不会提前闭合。
+    块不完整（或遇到未闭合的字符串）时返回 None。
+    """
+    depth = 0
+    for m in _RE_JSON_SCAN.finditer(page, start):
+        tok = m.group()
+        if tok == b"{":
+            depth += 1
+        elif tok == b"}":
+            depth -= 1
+            if depth == 0:
+                return m.end()
+        elif len(tok) == 1:
+            return None
+    return None
 
+def _clean_json_candidate(candidate: str, use_lxml: bool = True) -> str:
+    """慢路径：修掉页面上 JSON 块里常见的 HTML 标签、省略号、注释和尾随逗号。"""
+    # 每一步清理前先用 `in` 判断（C 层 memchr），不含对应字符时直接跳过正则
     # 清理 HTML 实体 / 多余的省略符号（网站示例有时会显示 "..."）
     # 将 HTML 标签移除（如果误包含）
-    candidate = re.sub(r"<[^>]+>", "", candidate)
+    if "<" in candidate:
+        candidate = _strip_html_tags(candidate, use_lxml)
 
     # 有些页面会在片段中显示 "..." 或省略信息，我们不能解析含有 "..." 的 JSON
     # 将出现的三点替换为 null 或将其删除（如果存在）
-    candidate = candidate.replace("...", "")
+    if "..." in candidate:
+        candidate = candidate.replace("...", "")
 
     # 进一步清理：去掉单行注释或尾随逗号（尝试修复小错误以便 json.loads 成功）
     # 去掉 JavaScript 注释
-    candidate = re.sub(r"//.*?$", "", candidate, flags=re.MULTILINE)
+    if "//" in candidate:
+        candidate = _RE_COMMENT.sub("", candidate)
     # 删除尾随逗号 (e.g., {"a":1,})
-    candidate = re.sub(r",\s*}", "}", candidate)
-    candidate = re.sub(r",\s*]", "]", candidate)
+    if "," in candidate:
+        candidate = _RE_TRAIL_OBJ.sub("}", candidate)
+        candidate = _RE_TRAIL_ARR.sub("]", candidate)
 
     return candidate
 
+def _json_dumps(obj: Any) -> str:
+    """紧凑、不转义非 ASCII 的 JSON 字符串。"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def _extract_quoted(data: bytes, key: str, start: int = 0) -> Optional[str]:
+    """
+    用 bytes.find 在 data 中查找 `"key": "value"` 并返回解码后的 value（等价于
+    正则 `"key"\\s*:\\s*"([^"]+)"`，但不进正则引擎）。找不到时返回 None。
+    """
+    needle = f'"{key}"'.encode("ascii")
+    n = len(data)
+    i = data.find(needle, start)
+    while i != -1:
+        j = i + len(needle)
+        while j < n and data[j] in _WHITESPACE:
+            j += 1
+        if j < n and data[j] == _COLON:
+            j += 1
+            while j < n and data[j] in _WHITESPACE:
+                j += 1
+            if j < n and data[j] == _QUOTE:
+                end = data.find(b'"', j + 1)
+                if end > j + 1:
+                    return _decode(data[j + 1:end])
+        i = data.find(needle, i + 1)
+    return None
+
+def _loads_json_object(data: bytes) -> Optional[Dict[str, Any]]:
+    """严格解析（orjson / json 都直接接受 bytes）；失败或不是对象时返回 None。"""
+    try:
+        parsed = orjson.loads(data) if orjson is not None else json.loads(data)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
 def _safe_json_loads(s: str) -> Optional[Dict[str, Any]]:
     try:
+        if orjson is not None:
+            return orjson.loads(s)
         return json.loads(s)
     except Exception:
         # 如果解析失败，尝试使用更宽松的替换（例如将单引号换成双引号）
+        # 这里固定用标准库 json：orjson 更严格，宽松修复后的文本交给它意义不大
         try:
             s2 = s.replace("'", "\"")
             return json.loads(s2)
         except Exception:
             return None
 
-def CheckIP(ip: str, user_agents_list: Optional[List[str]] = None, session: Optional[requests.Session] = None) -> Dict[str, Any]:
+def _fallback_extract(ip: str, page: bytes, marker_pos: int) -> Dict[str, Any]:
+    # 作为降级尝试：在 marker 附近直接找 "ip":"...", "score":"...", "risk":"..."
+    if marker_pos != -1:
+        window = page[marker_pos:marker_pos + _FALLBACK_WINDOW]
+    else:
+        window = page[:_FALLBACK_HEAD]
+    found = {}
+    for key in ("ip", "score", "risk"):
+        value = _extract_quoted(window, key)
+        if value is not None:
+            found[key] = value
+    if found:
+        return {"ip": ip, **found}
+    return {"ip": ip, "error": "no_json_block_found"}
+
+def _parse_page(ip: str, page: bytes) -> Dict[str, Any]:
     """
-    查询 scamalytics.com 对单个 IP 的页面并解析出结果。
-    返回一个 dict，至少包含 ip 字段；在成功时返回 "score" 和 "risk" 等（字符串）。
-    失败时返回 {'ip': ip, 'error': '...'}。
+    纯 CPU 的解析阶段：从页面字节中提取结果 dict。
+    定位 / 扫描都在 bytes 上做，只把 JSON 块（或取出的字段值）解码成 str。
+    放在模块顶层，以便 ProcessPoolExecutor 可以 pickle 调用。
     """
-    ua = _choose_user_agent(user_agents_list)
-    try:
-        text = _fetch_page(ip, ua, session=session)
-    except requests.RequestException as e:
-        return {"ip": ip, "error": f"http_error: {str(e)}"}
+    marker_pos = page.find(_API_MARKER_BYTES)
+    # 从 marker 向后找第一个 '{'；备用：有些页面可能直接包含 `"ip":"...","score":"..."` 但缺关键词
+    start = page.find(b"{", max(marker_pos, 0))
+    if start == -1:
+        return _fallback_extract(ip, page, marker_pos)
+
+    # 快速路径：按合法 JSON 定位（跳过字符串里的括号）后直接严格解析（有 orjson 时用 orjson）
+    parsed = None
+    end = _find_json_end(page, start)
+    if end is not None:
+        parsed = _loads_json_object(page[start:end])
 
-    json_block = _extract_json_block_from_text(text)
-    if not json_block:
-        # 作为降级尝试：在页面中直接用正则找到 "ip":"...", "score":"...", "risk":"..."
-        m_ip = re.search(r'"ip"\s*:\s*"([^"]+)"', text)
-        m_score = re.search(r'"score"\s*:\s*"([^"]+)"', text)
-        m_risk = re.search(r'"risk"\s*:\s*"([^"]+)"', text)
-        if m_ip or m_score or m_risk:
-            result = {"ip": ip}
-            if m_ip:
-                result["ip"] = m_ip.group(1)
-            if m_score:
-                result["score"] = m_score.group(1)
-            if m_risk:
-                result["risk"] = m_risk.group(1)
-            return result
-        return {"ip": ip, "error": "no_json_block_found"}
-
-    parsed = _safe_json_loads(json_block)
     if not parsed:
-        # 返回原始 json_block 以便用户调试
-        return {"ip": ip, "error": "json_parse_failed", "raw": json_block[:200]}
+        # 慢路径：块里混了 HTML / 注释等，退回纯括号配对 + 清理
+        end = _find_block_end(page, start)
+        if end is None:
+            return _fallback_extract(ip, page, marker_pos)
+        raw_block = _decode(page[start:end])
+        json_block = _clean_json_candidate(raw_block)
+        parsed = _safe_json_loads(json_block)
+        if not parsed and _lxml_html is not None and "<" in raw_block:
+            # lxml 解码了字符串值里的实体导致解析失败时，退回正则去标签再试一次
+            json_block = _clean_json_candidate(raw_block, use_lxml=False)
+            parsed = _safe_json_loads(json_block)
+        if not parsed:
+            # 返回原始 json_block 以便用户调试
+            return {"ip": ip, "error": "json_parse_failed", "raw": json_block[:200]}
 
     # 保证返回至少 ip, score, risk 三个字段
     out = {"ip": parsed.get("ip", ip)}
@@ -152,7 +325,31 @@ def CheckIP(ip: str, user_agents_list: Optional[List[str]] = None, session: Opti
             out[k] = parsed[k]
 
     # 将剩余字段以 flat 的方式并入（可选）
-    # 出于简洁默认不全部并入；用户可以从 parsed 获取全部信息。
-    out["_raw_parsed"] = parsed  # 如果用户需要全部信息可查看这个键
+    # 出于简洁默认不全部并入；完整 JSON 以紧凑字符串形式放在 raw_json 里，
+    # 不再持有整棵解析树（字符串比 dict/list 对象树小得多）。
+    out["raw_json"] = _json_dumps(parsed)
 
     return out
+
+async def CheckIP(ip: str, user_agents_list: Optional[List[str]] = None, *, client: httpx.AsyncClient,
+                  limiter: Optional[RateLimiter] = None, parse_executor: Optional[Executor] = None) -> Dict[str, Any]:
+    """
+    查询 scamalytics.com 对单个 IP 的页面并解析出结果。
+    client 为调用方共享的 httpx.AsyncClient：所有请求都打到同一个 host，
+    复用连接可以省掉除第一次以外的 TCP+TLS 握手。
+    limiter 为可选的共享 RateLimiter；遇到 429/5xx 时会退避重试。
+    parse_executor 不为 None 时，页面解析放到该执行器（通常是进程池）里跑，
+    不占用事件循环所在线程。
+    返回一个 dict，至少包含 ip 字段；在成功时返回 "score" 和 "risk" 等（字符串）。
+    失败时返回 {'ip': ip, 'error': '...'}。
+    """
+    ua = _choose_user_agent(user_agents_list)
+    try:
+        page = await _fetch_page_with_retry(client, ip, ua, limiter)
+    except httpx.HTTPError as e:
+        return {"ip": ip, "error": f"http_error: {str(e)}"}
+
+    if parse_executor is None:
+        return _parse_page(ip, page)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(parse_executor, _parse_page, ip, page)
@@ -0,0 +1,80 @@
+"""
+ipchecker 页面解析的回归检查（不联网）：覆盖字符串感知的块定位和降级查找。
+运行: python -m pytest -q
+"""
+
+from ipchecker.ipchecker import _extract_quoted, _find_json_end, _parse_page
+
+MARKER = b"IP Fraud Risk API <pre>"
+
+
+def test_find_json_end_skips_brace_inside_string():
+    page = b'x {"ip":"1.1.1.1","hostname":"a}b"} tail }'
+    start = page.index(b"{")
+    assert page[start:_find_json_end(page, start)] == b'{"ip":"1.1.1.1","hostname":"a}b"}'
+
+
+def test_find_json_end_skips_escaped_quote():
+    page = b'{"operator":"AT&T \\"x}\\"","ip":"1.1.1.1"} tail'
+    assert page[:_find_json_end(page, 0)] == b'{"operator":"AT&T \\"x}\\"","ip":"1.1.1.1"}'
+
+
+def test_find_json_end_unterminated_string():
+    assert _find_json_end(b'{"ip":"1.1.1.1","hostname":"a}', 0) is None
+
+
+def test_parse_page_brace_inside_string():
+    page = MARKER + b'{"ip":"1.1.1.1","score":"5","risk":"low","hostname":"a}b"}</pre>'
+    assert _parse_page("x", page) == {
+        "ip": "1.1.1.1",
+        "score": "5",
+        "risk": "low",
+        "hostname": "a}b",
+        "raw_json": '{"ip":"1.1.1.1","score":"5","risk":"low","hostname":"a}b"}',
+    }
+
+
+def test_parse_page_escaped_quote():
+    page = MARKER + b'{"ip":"1.1.1.1","score":"1","operator":"AT&T \\"x\\""}</pre>'
+    result = _parse_page("x", page)
+    assert result["operator"] == 'AT&T "x"'
+    assert result["raw_json"] == '{"ip":"1.1.1.1","score":"1","operator":"AT&T \\"x\\""}'
+
+
+def test_parse_page_unterminated_string():
+    page = MARKER + b'{"ip":"1.1.1.1","hostname":"a}'
+    assert _parse_page("x", page)["error"] == "json_parse_failed"
+
+
+def test_parse_page_html_inside_block():
+    page = MARKER + b'{"ip":"1.1.1.1",<b>"score"</b>:"5", // note\n "risk":"low",}</pre>'
+    result = _parse_page("x", page)
+    assert (result["ip"], result["score"], result["risk"]) == ("1.1.1.1", "5", "low")
+
+
+def test_parse_page_html_with_entities_in_string():
+    # lxml 会把 &quot; 解码进字符串值；解析失败时要退回正则去标签
+    page = MARKER + b'{"ip":"1.1.1.1","score":"1","risk":"<b>low</b>","operator":"Foo &quot;Bar&quot;",}'
+    result = _parse_page("x", page)
+    assert (result["risk"], result["operator"]) == ("low", "Foo &quot;Bar&quot;")
+
+
+def test_parse_page_no_marker():
+    page = b'<html>{"ip":"2.2.2.2","score":"3"}</html>'
+    assert _parse_page("x", page)["score"] == "3"
+
+
+def test_parse_page_no_json_block():
+    assert _parse_page("x", b"<html>nothing here</html>") == {"ip": "x", "error": "no_json_block_found"}
+
+
+def test_parse_page_fallback_without_braces():
+    page = b'IP Fraud Risk API "ip" : "3.3.3.3", "score":"9"'
+    assert _parse_page("x", page) == {"ip": "3.3.3.3", "score": "9"}
+
+
+def test_extract_quoted():
+    assert _extract_quoted(b'"score" :\n "7"', "score") == "7"
+    assert _extract_quoted(b'"score":"", "score":"8"', "score") == "8"
+    assert _extract_quoted(b'"score": 7', "score") is None
+    assert _extract_quoted(b'"scored":"1"', "score") is None